@@ -1,13 +1,18 @@
 from flask import Flask, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider, JSONProvider
 from flask_cors import CORS
 import logging
+import orjson
 import os
 from datetime import datetime
 from config.config import config
-from config.database import init_db
+from config.database import init_db, db
 from chatbot.event_handler import EventHandler
 from chatbot.chatbot_service import ChatbotService
-from chatbot.models import Booking, ChatSession
+from chatbot.models import Booking, ChatSession, ChatMessage
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from chatbot.tasks import celery, process_booking_event
 
 # Configure logging
 logging.basicConfig(
@@ -16,9 +21,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider using orjson for request parsing and responses
+
+    Output matches Flask's default provider: keys are sorted and dates are
+    rendered in the HTTP date format rather than orjson's ISO 8601.
+    """
+
+    sort_keys = True
+    default = staticmethod(DefaultJSONProvider.default)
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 def create_app(config_name=None):
     """Create Flask application"""
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
 
     # Load configuration
     config_name = config_name or os.environ.get('FLASK_ENV', 'development')
@@ -31,7 +56,7 @@ def create_app(config_name=None):
     init_db(app)
 
     # Initialize services
-    event_handler = EventHandler()
+    event_handler = EventHandler(app.config.get('WEBHOOK_SECRET'))
     chatbot_service = ChatbotService()
 
     @app.route('/')
@@ -48,6 +73,14 @@ def create_app(config_name=None):
             'service': 'treebo-chatbot'
         })
 
+    @app.route('/health/pool', methods=['GET'])
+    def pool_status():
+        """Database connection pool status"""
+        return jsonify({
+            'status': db.engine.pool.status(),
+            'timestamp': datetime.utcnow().isoformat()
+        })
+
     @app.route('/webhook/booking', methods=['POST'])
     def booking_webhook():
         """Webhook endpoint for receiving booking events"""
@@ -55,22 +88,27 @@ def create_app(config_name=None):
             # Verify webhook signature if configured
             signature = request.headers.get('X-Signature-256')
             if signature and app.config.get('WEBHOOK_SECRET'):
-                if not event_handler.verify_webhook_signature(
-                    request.data,
-                    signature,
-                    app.config['WEBHOOK_SECRET']
-                ):
+                if not event_handler.verify_webhook_signature(request.data, signature):
                     logger.warning("Invalid webhook signature")
                     return jsonify({'error': 'Invalid signature'}), 401
 
             # Process the event
             event_data = request.get_json()
-            if not event_data:
+            if not isinstance(event_data, dict) or not event_data:
                 return jsonify({'error': 'No JSON data provided'}), 400
 
             logger.info(f"Received booking event: {event_data.get('event_type')}")
 
-            result = event_handler.process_booking_event(event_data)
+            validated = event_handler.validate_booking_event(event_data)
+            if validated and app.config.get('PROCESS_BOOKING_EVENTS_ASYNC'):
+                task = process_booking_event.delay(event_data)
+                return jsonify({
+                    'status': 'queued',
+                    'booking_id': event_data['booking']['booking_id'],
+                    'task_id': task.id
+                }), 202
+
+            result = event_handler.process_booking_event(event_data, validated=validated)
 
             return jsonify(result), 200
 
@@ -164,7 +202,7 @@ def create_app(config_name=None):
     def get_booking(booking_id):
         """Get booking information"""
         try:
-            booking = Booking.query.filter_by(booking_id=booking_id).first()
+            booking = Booking.get_by_booking_id(booking_id)
             if not booking:
                 return jsonify({'error': 'Booking not found'}), 404
 
@@ -178,10 +216,23 @@ def create_app(config_name=None):
     def get_booking_sessions(booking_id):
         """Get all chat sessions for a booking"""
         try:
-            booking = Booking.query.filter_by(booking_id=booking_id).first()
+            booking = Booking.get_by_booking_id(booking_id)
             if not booking:
                 return jsonify({'error': 'Booking not found'}), 404
 
+            # Count messages for all sessions in one grouped query
+            message_counts = dict(
+                db.session.query(ChatMessage.session_id, func.count(ChatMessage.id))
+                .join(ChatSession, ChatMessage.session_id == ChatSession.id)
+                .filter(ChatSession.booking_id == booking.id)
+                .group_by(ChatMessage.session_id)
+                .all()
+            )
+            # Cached transcripts also include messages that are not flushed yet
+            message_counts.update(chatbot_service.get_buffered_message_counts(
+                [session.id for session in booking.chat_sessions]
+            ))
+
             sessions = []
             for session in booking.chat_sessions:
                 sessions.append({
@@ -190,7 +241,7 @@ def create_app(config_name=None):
                     'is_active': session.is_active,
                     'created_at': session.created_at.isoformat(),
                     'updated_at': session.updated_at.isoformat(),
-                    'message_count': len(session.messages)
+                    'message_count': message_counts.get(session.id, 0)
                 })
 
             return jsonify({
@@ -209,12 +260,12 @@ def create_app(config_name=None):
             total_bookings = Booking.query.count()
             total_sessions = ChatSession.query.count()
             active_sessions = ChatSession.query.filter_by(is_active=True).count()
-            total_messages = ChatMessage.query.count()
+            total_messages = ChatMessage.query.count() + chatbot_service.get_pending_message_count()
 
             # Calculate average response time (mock data for now)
             avg_response_time = 250
 
-            # Count recommendations given
+            # Count recommendations given, messages still buffered in Redis are counted once flushed
             recommendations_count = ChatMessage.query.filter(
                 ChatMessage.content.contains('recommendations')
             ).count()
@@ -241,14 +292,17 @@ def create_app(config_name=None):
     def get_admin_sessions():
         """Get all chat sessions for admin dashboard"""
         try:
-            sessions = ChatSession.query.order_by(ChatSession.created_at.desc()).limit(20).all()
+            # Load the bookings of all listed sessions in one IN query instead of one per row
+            sessions = ChatSession.query.options(
+                selectinload(ChatSession.booking)
+            ).order_by(ChatSession.created_at.desc()).limit(20).all()
 
             sessions_data = []
             for session in sessions:
                 sessions_data.append({
                     'session_id': session.session_id,
-                    'guest_name': session.guest_name,
-                    'hotel_location': session.hotel_location,
+                    'guest_name': session.booking.guest_name,
+                    'hotel_location': session.booking.hotel_location,
                     'created_at': session.created_at.isoformat(),
                     'is_active': session.is_active
                 })
@@ -1,14 +1,58 @@
 import logging
 import uuid
 from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import text, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import undefer
 from chatbot.models import ChatSession, ChatMessage, Booking, db
 from chatbot.recommendation_engine import RecommendationEngine
 from chatbot.translation_service import TranslationService
+from config.config import Config
 from config.database import get_redis_client
-import json
+import orjson
 
 logger = logging.getLogger(__name__)
 
+PENDING_MESSAGES_KEY = 'chat:pending'
+# Buffered messages that can never be written to the database, kept for inspection
+DEAD_MESSAGES_KEY = 'chat:dead'
+
+# Errors caused by the content of a single buffered message rather than the database
+MESSAGE_ROW_ERRORS = (IntegrityError, DataError, ValueError, KeyError, TypeError)
+
+MESSAGE_ID_SEQUENCE_SELECT = text(
+    "SELECT nextval(pg_get_serial_sequence('chat_messages', 'id')) FROM generate_series(1, :count)"
+)
+
+RECOMMENDATIONS_HEADER_TEMPLATES = {
+    'en': "Here are the top {category} recommendations near your hotel:",
+    'hi': "यहाँ आपके होटल के पास के शीर्ष {category} सुझाव हैं:",
+    'es': "Aquí están las mejores recomendaciones de {category} cerca de tu hotel:",
+    'fr': "Voici les meilleures recommandations de {category} près de votre hôtel:"
+}
+
+NO_RECOMMENDATIONS_TEMPLATES = {
+    'en': "Sorry, I couldn't find any {category} recommendations near your hotel at the moment.",
+    'hi': "क्षमा करें, मुझे इस समय आपके होटल के पास कोई {category} सुझाव नहीं मिल सके।",
+    'es': "Lo siento, no pude encontrar recomendaciones de {category} cerca de tu hotel en este momento.",
+    'fr': "Désolé, je n'ai pas pu trouver de recommandations de {category} près de votre hôtel pour le moment."
+}
+
+CATEGORY_OPTIONS_HEADERS = {
+    'en': "What would you like to explore? Choose from:",
+    'hi': "आप क्या खोजना चाहेंगे? इनमें से चुनें:",
+    'es': "¿Qué te gustaría explorar? Elige entre:",
+    'fr': "Que souhaitez-vous explorer? Choisissez parmi:"
+}
+
+GENERAL_HELP_MESSAGES = {
+    'en': "I can help you discover amazing places around your hotel! You can ask me about restaurants, sightseeing attractions, events, shopping, or nightlife. What interests you most?",
+    'hi': "मैं आपके होटल के आसपास के अद्भुत स्थानों की खोज में आपकी मदद कर सकता हूं! आप मुझसे रेस्तरां, दर्शनीय स्थल, कार्यक्रम, खरीदारी या रात्रि जीवन के बारे में पूछ सकते हैं। आपको सबसे ज्यादा क्या दिलचस्पी है?",
+    'es': "¡Puedo ayudarte a descubrir lugares increíbles alrededor de tu hotel! Puedes preguntarme sobre restaurantes, atracciones turísticas, eventos, compras o vida nocturna. ¿Qué te interesa más?",
+    'fr': "Je peux vous aider à découvrir des endroits incroyables autour de votre hôtel! Vous pouvez me demander des restaurants, des attractions touristiques, des événements, du shopping ou de la vie nocturne. Qu'est-ce qui vous intéresse le plus?"
+}
+
 class ChatbotService:
     """Main chatbot service for handling user interactions"""
 
@@ -16,11 +60,16 @@ class ChatbotService:
         self.recommendation_engine = RecommendationEngine()
         self.translation_service = TranslationService()
         self.redis_client = get_redis_client()
+        self._category_options_message = lru_cache(maxsize=32)(self._render_category_options)
+
+    def create_chat_session(self, booking_id, guest_language='en', booking=None):
+        """Create a new chat session for a booking
 
-    def create_chat_session(self, booking_id, guest_language='en'):
-        """Create a new chat session for a booking"""
+        Callers that already hold the Booking can pass it to skip the lookup.
+        """
         try:
-            booking = Booking.query.filter_by(booking_id=booking_id).first()
+            if booking is None:
+                booking = Booking.get_by_booking_id(booking_id)
             if not booking:
                 raise ValueError(f"Booking {booking_id} not found")
 
@@ -35,35 +84,25 @@ class ChatbotService:
             db.session.add(chat_session)
             db.session.commit()
 
-            # Send welcome message
+            # Send welcome message and category options
             welcome_message = self.translation_service.get_welcome_message(
                 booking.guest_name,
                 booking.hotel_name,
                 guest_language
             )
 
-            self._add_message(
-                chat_session.id,
-                'bot',
-                welcome_message,
-                {'type': 'welcome', 'booking_id': booking_id}
-            )
+            category_options, options_message = self._category_options_message(guest_language)
 
-            # Send category options
-            category_options = self.translation_service.get_category_options(guest_language)
-            options_message = self._format_category_options(category_options, guest_language)
-
-            self._add_message(
-                chat_session.id,
-                'bot',
-                options_message,
-                {'type': 'category_options', 'options': category_options}
-            )
+            # A new session has no other messages, so these are its full history
+            messages = self._add_messages(chat_session.id, [
+                ('bot', welcome_message, {'type': 'welcome', 'booking_id': booking_id}),
+                ('bot', options_message, {'type': 'category_options', 'options': category_options})
+            ], new_session=True)
 
             return {
                 'session_id': session_id,
                 'booking': booking.to_dict(),
-                'messages': self._get_session_messages(chat_session.id)
+                'messages': messages
             }
 
         except Exception as e:
@@ -94,7 +133,11 @@ class ChatbotService:
             )
 
             # Update session timestamp
-            chat_session.updated_at = datetime.utcnow()
+            db.session.execute(
+                update(ChatSession)
+                .where(ChatSession.id == chat_session.id)
+                .values(updated_at=datetime.utcnow())
+            )
             db.session.commit()
 
             return {
@@ -301,14 +344,7 @@ class ChatbotService:
 
     def _handle_general_request(self, user_message, language):
         """Handle general requests"""
-        responses = {
-            'en': "I can help you discover amazing places around your hotel! You can ask me about restaurants, sightseeing attractions, events, shopping, or nightlife. What interests you most?",
-            'hi': "मैं आपके होटल के आसपास के अद्भुत स्थानों की खोज में आपकी मदद कर सकता हूं! आप मुझसे रेस्तरां, दर्शनीय स्थल, कार्यक्रम, खरीदारी या रात्रि जीवन के बारे में पूछ सकते हैं। आपको सबसे ज्यादा क्या दिलचस्पी है?",
-            'es': "¡Puedo ayudarte a descubrir lugares increíbles alrededor de tu hotel! Puedes preguntarme sobre restaurantes, atracciones turísticas, eventos, compras o vida nocturna. ¿Qué te interesa más?",
-            'fr': "Je peux vous aider à découvrir des endroits incroyables autour de votre hôtel! Vous pouvez me demander des restaurants, des attractions touristiques, des événements, du shopping ou de la vie nocturne. Qu'est-ce qui vous intéresse le plus?"
-        }
-
-        message = responses.get(language, responses['en'])
+        message = GENERAL_HELP_MESSAGES.get(language, GENERAL_HELP_MESSAGES['en'])
 
         return {
             'message': message,
@@ -318,72 +354,249 @@ class ChatbotService:
     def _format_recommendations_message(self, recommendations, category, language):
         """Format recommendations into a readable message"""
         if not recommendations:
-            no_results = {
-                'en': f"Sorry, I couldn't find any {category} recommendations near your hotel at the moment.",
-                'hi': f"क्षमा करें, मुझे इस समय आपके होटल के पास कोई {category} सुझाव नहीं मिल सके।",
-                'es': f"Lo siento, no pude encontrar recomendaciones de {category} cerca de tu hotel en este momento.",
-                'fr': f"Désolé, je n'ai pas pu trouver de recommandations de {category} près de votre hôtel pour le moment."
-            }
-            return no_results.get(language, no_results['en'])
-
-        headers = {
-            'en': f"Here are the top {category} recommendations near your hotel:",
-            'hi': f"यहाँ आपके होटल के पास के शीर्ष {category} सुझाव हैं:",
-            'es': f"Aquí están las mejores recomendaciones de {category} cerca de tu hotel:",
-            'fr': f"Voici les meilleures recommandations de {category} près de votre hôtel:"
-        }
+            template = NO_RECOMMENDATIONS_TEMPLATES.get(language, NO_RECOMMENDATIONS_TEMPLATES['en'])
+            return template.format(category=category)
 
-        message = headers.get(language, headers['en']) + "\n\n"
+        header = RECOMMENDATIONS_HEADER_TEMPLATES.get(language, RECOMMENDATIONS_HEADER_TEMPLATES['en'])
+        lines = [header.format(category=category), ""]
+        append = lines.append
 
         for i, rec in enumerate(recommendations[:5], 1):
-            message += f"{i}. **{rec.get('name', 'Unknown')}**\n"
-            if rec.get('rating'):
-                message += f"   ⭐ Rating: {rec['rating']}/5\n"
-            if rec.get('distance'):
-                message += f"   📍 Distance: {rec['distance']} km\n"
-            if rec.get('address'):
-                message += f"   📍 Address: {rec['address']}\n"
-            if rec.get('phone'):
-                message += f"   📞 Phone: {rec['phone']}\n"
-            message += "\n"
-
-        return message
+            append(f"{i}. **{rec.get('name', 'Unknown')}**")
+            rating = rec.get('rating')
+            if rating:
+                append(f"   ⭐ Rating: {rating}/5")
+            distance = rec.get('distance')
+            if distance:
+                append(f"   📍 Distance: {distance} km")
+            address = rec.get('address')
+            if address:
+                append(f"   📍 Address: {address}")
+            phone = rec.get('phone')
+            if phone:
+                append(f"   📞 Phone: {phone}")
+            append("")
+
+        return "\n".join(lines) + "\n"
+
+    def _render_category_options(self, language):
+        """Get the category options and their rendered message for a language"""
+        options = self.translation_service.get_category_options(language)
+        return options, self._format_category_options(options, language)
 
     def _format_category_options(self, options, language):
         """Format category options message"""
-        headers = {
-            'en': "What would you like to explore? Choose from:",
-            'hi': "आप क्या खोजना चाहेंगे? इनमें से चुनें:",
-            'es': "¿Qué te gustaría explorar? Elige entre:",
-            'fr': "Que souhaitez-vous explorer? Choisissez parmi:"
-        }
+        header = CATEGORY_OPTIONS_HEADERS.get(language, CATEGORY_OPTIONS_HEADERS['en'])
+        return header + "\n\n" + "".join([f"• {value}\n" for value in options.values()])
 
-        message = headers.get(language, headers['en']) + "\n\n"
+    def _add_message(self, session_id, message_type, content, metadata=None):
+        """Add a message to the chat session"""
+        return self._add_messages(session_id, [(message_type, content, metadata)])[0]
+
+    def _add_messages(self, session_id, entries, new_session=False):
+        """Add (message_type, content, metadata) entries to the chat session in one batch
+
+        Messages are written to Redis and persisted to the database in batches
+        by the ``flush_chat_messages`` task. If Redis is unavailable the messages
+        are written straight to the database instead. new_session skips loading
+        earlier history for a session that has none.
+        """
+        messages = [
+            {
+                'id': None,
+                'message_type': message_type,
+                'content': content,
+                'metadata': metadata,
+                'timestamp': datetime.utcnow().isoformat()
+            }
+            for message_type, content, metadata in entries
+        ]
 
-        for key, value in options.items():
-            message += f"• {value}\n"
+        try:
+            transcript_length = self._buffer_messages(session_id, messages)
+        except Exception as e:
+            logger.error(f"Error buffering chat messages, writing to database: {e}")
+            return self._write_messages(session_id, entries)
 
-        return message
+        # The messages are queued from here on, so failures must not fall back to a second write
+        if transcript_length == len(messages) and not new_session:
+            self._seed_transcript(session_id)
 
-    def _add_message(self, session_id, message_type, content, metadata=None):
-        """Add a message to the chat session"""
-        message = ChatMessage(
-            session_id=session_id,
-            message_type=message_type,
-            content=content,
-            message_metadata=metadata
-        )
+        return messages
+
+    def _write_messages(self, session_id, entries):
+        """Write messages straight to the database"""
+        chat_messages = [
+            ChatMessage(
+                session_id=session_id,
+                message_type=message_type,
+                content=content,
+                message_metadata=metadata
+            )
+            for message_type, content, metadata in entries
+        ]
 
-        db.session.add(message)
+        db.session.add_all(chat_messages)
         db.session.commit()
 
-        return message
+        return [chat_message.to_dict() for chat_message in chat_messages]
+
+    def _buffer_messages(self, session_id, messages):
+        """Append messages to the session transcript and the pending queue in Redis
+
+        Assigns each message its id and returns the transcript length after the append.
+        """
+        for message, message_id in zip(messages, self._allocate_message_ids(len(messages))):
+            message['id'] = message_id
+
+        transcript_key = f"chat:{session_id}"
+
+        pipe = self.redis_client.pipeline()
+        pipe.rpush(transcript_key, *[orjson.dumps(m) for m in messages])
+        pipe.expire(transcript_key, Config.MESSAGE_BUFFER_TTL)
+        pipe.rpush(
+            PENDING_MESSAGES_KEY,
+            *[orjson.dumps({'session_id': session_id, **m}) for m in messages]
+        )
+        return pipe.execute()[0]
+
+    def _allocate_message_ids(self, count):
+        """Reserve ids for buffered messages so they are returned before the rows are written
+
+        PostgreSQL ids come from the table's own sequence, so they never collide with
+        rows written directly. Other dialects have no sequence to reserve from, their
+        buffered messages get an id from the database when they are flushed.
+        """
+        if db.engine.dialect.name != 'postgresql':
+            return [None] * count
+
+        return db.session.execute(MESSAGE_ID_SEQUENCE_SELECT, {'count': count}).scalars().all()
+
+    def _seed_transcript(self, session_id):
+        """Prepend persisted history to a transcript that was not cached (expired session)"""
+        transcript_key = f"chat:{session_id}"
+
+        try:
+            persisted_messages = self._get_persisted_messages(session_id)
+            if persisted_messages:
+                self.redis_client.lpush(
+                    transcript_key,
+                    *[orjson.dumps(m) for m in reversed(persisted_messages)]
+                )
+        except Exception as e:
+            logger.error(f"Error seeding chat transcript for session {session_id}: {e}")
+            try:
+                # An incomplete transcript would hide the history, read from the database instead
+                self.redis_client.delete(transcript_key)
+            except Exception:
+                pass
 
     def _get_session_messages(self, session_id):
         """Get all messages for a chat session"""
-        messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp).all()
+        try:
+            cached_messages = self.redis_client.lrange(f"chat:{session_id}", 0, -1)
+            if cached_messages:
+                return [orjson.loads(m) for m in cached_messages]
+        except Exception as e:
+            logger.error(f"Error reading buffered chat messages: {e}")
+
+        return self._get_persisted_messages(session_id)
+
+    def _get_persisted_messages(self, session_id):
+        """Get all messages for a chat session from the database"""
+        messages = ChatMessage.query.filter_by(session_id=session_id).options(
+            undefer(ChatMessage.message_metadata)
+        ).order_by(ChatMessage.timestamp, ChatMessage.id).all()
         return [message.to_dict() for message in messages]
 
+    def get_buffered_message_counts(self, session_ids):
+        """Message counts for the sessions whose transcript is cached in Redis
+
+        A cached transcript holds the session's whole history, including messages
+        not yet flushed to the database. Sessions without one are left out.
+        """
+        try:
+            pipe = self.redis_client.pipeline()
+            for session_id in session_ids:
+                pipe.llen(f"chat:{session_id}")
+            return {
+                session_id: count
+                for session_id, count in zip(session_ids, pipe.execute())
+                if count
+            }
+        except Exception as e:
+            logger.error(f"Error counting buffered chat messages: {e}")
+            return {}
+
+    def get_pending_message_count(self):
+        """Number of buffered messages not yet flushed to the database"""
+        try:
+            return self.redis_client.llen(PENDING_MESSAGES_KEY)
+        except Exception as e:
+            logger.error(f"Error counting pending chat messages: {e}")
+            return 0
+
+    def flush_buffered_messages(self, batch_size=None):
+        """Persist messages buffered in Redis to the database, returns the number flushed
+
+        If the batch cannot be written as a whole, messages are written one at a
+        time and those that still fail are moved to the dead-letter list so they
+        do not block the messages queued behind them.
+        """
+        batch_size = batch_size or Config.MESSAGE_FLUSH_BATCH_SIZE
+
+        pipe = self.redis_client.pipeline()
+        pipe.lrange(PENDING_MESSAGES_KEY, 0, batch_size - 1)
+        pipe.ltrim(PENDING_MESSAGES_KEY, batch_size, -1)
+        raw_messages = pipe.execute()[0]
+
+        if not raw_messages:
+            return 0
+
+        try:
+            db.session.bulk_save_objects([self._to_chat_message(m) for m in raw_messages])
+            db.session.commit()
+            return len(raw_messages)
+        except MESSAGE_ROW_ERRORS as e:
+            logger.warning(f"Error flushing chat message batch, writing messages one at a time: {e}")
+            db.session.rollback()
+        except Exception as e:
+            logger.error(f"Error flushing buffered chat messages: {e}")
+            db.session.rollback()
+            # Put the batch back at the head of the queue for the next run
+            self.redis_client.lpush(PENDING_MESSAGES_KEY, *reversed(raw_messages))
+            raise
+
+        flushed = 0
+        for index, raw_message in enumerate(raw_messages):
+            try:
+                db.session.add(self._to_chat_message(raw_message))
+                db.session.commit()
+                flushed += 1
+            except MESSAGE_ROW_ERRORS as e:
+                db.session.rollback()
+                logger.error(f"Moving unwritable chat message to {DEAD_MESSAGES_KEY}: {e}")
+                self.redis_client.rpush(DEAD_MESSAGES_KEY, raw_message)
+            except Exception as e:
+                logger.error(f"Error flushing buffered chat messages: {e}")
+                db.session.rollback()
+                self.redis_client.lpush(PENDING_MESSAGES_KEY, *reversed(raw_messages[index:]))
+                raise
+
+        return flushed
+
+    def _to_chat_message(self, raw_message):
+        """Build a ChatMessage from a buffered message"""
+        data = orjson.loads(raw_message)
+        return ChatMessage(
+            id=data.get('id'),
+            session_id=data['session_id'],
+            message_type=data['message_type'],
+            content=data['content'],
+            message_metadata=data['metadata'],
+            timestamp=datetime.fromisoformat(data['timestamp'])
+        )
+
     def get_chat_history(self, session_id):
         """Get chat history for a session"""
         try:
@@ -1,109 +1,273 @@
 import logging
-import json
-from datetime import datetime
-from chatbot.models import Booking, db
+import orjson
+from datetime import date, datetime, timedelta
+from functools import lru_cache, partial
+from sqlalchemy import case, func, update
+from sqlalchemy.exc import IntegrityError
+from chatbot.models import UPSERT_INSERTS, Booking, ChatSession, GeocodeCache, db
+from config.config import Config
 from chatbot.chatbot_service import ChatbotService
-from chatbot.translation_service import TranslationService
+from chatbot.tasks import geocode_booking
+from geopy.adapters import RequestsAdapter
 from geopy.geocoders import Nominatim
+from geopy.extra.rate_limiter import RateLimiter
 import hashlib
 import hmac
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+SIGNATURE_PREFIX = 'sha256='
+REQUIRED_BOOKING_FIELDS = ('booking_id', 'guest_name', 'guest_email', 'hotel_name', 'hotel_location')
+GEOCODE_CACHE_SIZE = 4096
+MIN_GEOCODE_LENGTH = 3
+# Unresolvable locations are retried after this long instead of on every event
+NEGATIVE_GEOCODE_TTL = timedelta(days=1)
+MAX_GEOCODE_FALLBACKS = 2
+# Fallbacks keep at least this many address parts, e.g. city and country
+MIN_FALLBACK_PARTS = 2
+# Results this coarse are too far from the hotel to be used as its coordinates
+COARSE_GEOCODE_TYPES = frozenset({'continent', 'country'})
+GEOCODE_TIMEOUT = 2
+GEOCODE_MIN_DELAY = 1
+# Worst case for one rate limited geocoder call
+GEOCODE_CALL_BUDGET = GEOCODE_MIN_DELAY + GEOCODE_TIMEOUT
+# Overall limit for inline lookups, fallbacks that would run past it are left to geocode_booking
+GEOCODE_DEADLINE = 4
+GEOCODE_BREAKER_FAIL_MAX = 5
+GEOCODE_BREAKER_RESET_TIMEOUT = 60
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency while its circuit breaker is open"""
+
+class GeocodeDeadlineExceeded(Exception):
+    """Raised when trying another geocode fallback could overrun the lookup deadline"""
+
+class CircuitBreaker:
+    """Stop calling a failing dependency for reset_timeout seconds after fail_max consecutive failures"""
+    
+    def __init__(self, fail_max, reset_timeout):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+    
+    def call(self, func, *args, **kwargs):
+        with self._lock:
+            if self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(func)
+        
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._failures += 1
+                if self._failures >= self.fail_max:
+                    self._opened_at = time.monotonic()
+            raise
+        
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+        return result
+
+# Shared by all handlers so the 1 request/second Nominatim usage limit holds per process.
+# RequestsAdapter keeps one pooled requests.Session, so calls reuse the TLS connection.
+# The short timeout and the breaker keep a slow or failing Nominatim off the webhook
+# path, failed lookups are retried later by the geocode_booking task instead.
+geocoder = Nominatim(
+    user_agent="treebo-chatbot",
+    adapter_factory=partial(RequestsAdapter, pool_connections=1, pool_maxsize=10),
+    timeout=GEOCODE_TIMEOUT
+)
+# Errors must reach the breaker, RateLimiter would otherwise turn them into a None miss
+rate_limited_geocode = RateLimiter(
+    geocoder.geocode,
+    min_delay_seconds=GEOCODE_MIN_DELAY,
+    max_retries=0,
+    swallow_exceptions=False
+)
+geocode_breaker = CircuitBreaker(GEOCODE_BREAKER_FAIL_MAX, GEOCODE_BREAKER_RESET_TIMEOUT)
+
+def parse_date(value):
+    """Parse the YYYY-MM-DD part of an ISO date or datetime string, None if empty"""
+    return date.fromisoformat(value[:10]) if value else None
+
+_MISSING = object()
+
+# Fields copied from booking.updated events, with an optional parser for the raw value.
+# hotel_location is handled separately because it also updates the coordinates.
+BOOKING_UPDATE_FIELDS = (
+    ('guest_name', None),
+    ('guest_email', None),
+    ('guest_phone', None),
+    ('check_in_date', parse_date),
+    ('check_out_date', parse_date),
+    ('guest_language', None)
+)
+
+def normalize_location(location_string):
+    """Normalize a location string for geocode cache lookups"""
+    return ' '.join(location_string.lower().split()).strip(' ,')
+
+def geocode_candidates(location):
+    """Yield a normalized location followed by coarser forms with leading parts dropped
+
+    "hotel name, area, city, country" falls back to "area, city, country" and
+    then "city, country", so an unknown hotel name still resolves to its
+    neighbourhood. Fallbacks never drop below MIN_FALLBACK_PARTS parts.
+    """
+    yield location
+    parts = [part for part in location.split(',') if part.strip()]
+    for start in range(1, min(len(parts) - MIN_FALLBACK_PARTS, MAX_GEOCODE_FALLBACKS) + 1):
+        candidate = normalize_location(','.join(parts[start:]))
+        if len(candidate) >= MIN_GEOCODE_LENGTH:
+            yield candidate
+
+def load_hotel_coordinates(path):
+    """Load known hotel coordinates keyed by normalized location from a JSON file"""
+    if not path:
+        return {}
+    
+    try:
+        with open(path, 'rb') as f:
+            catalog = orjson.loads(f.read())
+        return {
+            normalize_location(location): (float(latitude), float(longitude))
+            for location, (latitude, longitude) in catalog.items()
+        }
+    except Exception as e:
+        logger.error("Error loading hotel coordinates from %s: %s", path, e)
+        return {}
+
+# Coordinates of Treebo's own hotels, resolved without any cache or geocoder I/O
+HOTEL_COORDINATES = load_hotel_coordinates(Config.HOTEL_COORDINATES_FILE)
+
 class EventHandler:
     """Handler for processing booking events"""
     
-    def __init__(self):
+    def __init__(self, webhook_secret=None):
         self.chatbot_service = ChatbotService()
-        self.translation_service = TranslationService()
-        self.geocoder = Nominatim(user_agent="treebo-chatbot")
+        self.webhook_secret = webhook_secret.encode('utf-8') if webhook_secret else None
+        self.geocoder = geocoder
+        self._cached_coordinates = lru_cache(maxsize=GEOCODE_CACHE_SIZE)(self._resolve_coordinates)
+        self.event_handlers = {
+            'booking.created': self._handle_booking_created,
+            'booking.updated': self._handle_booking_updated,
+            'booking.cancelled': self._handle_booking_cancelled
+        }
     
-    def verify_webhook_signature(self, payload, signature, secret):
-        """Verify webhook signature for security"""
+    def verify_webhook_signature(self, payload, signature, secret=None):
+        """Verify webhook signature for security
+
+        Uses the secret given at construction unless one is passed explicitly.
+        """
         try:
-            expected_signature = hmac.new(
-                secret.encode('utf-8'),
-                payload,
-                hashlib.sha256
-            ).hexdigest()
+            if not signature.startswith(SIGNATURE_PREFIX):
+                return False
+            
+            key = secret.encode('utf-8') if secret is not None else self.webhook_secret
+            expected_signature = hmac.digest(key, payload, 'sha256')
+            provided_signature = bytes.fromhex(signature[len(SIGNATURE_PREFIX):])
             
-            return hmac.compare_digest(f"sha256={expected_signature}", signature)
+            # Digests must only be compared with compare_digest; == would leak
+            # the length of the matching prefix through timing
+            return hmac.compare_digest(expected_signature, provided_signature)
         except Exception as e:
-            logger.error(f"Error verifying webhook signature: {e}")
+            logger.error("Error verifying webhook signature: %s", e)
             return False
     
-    def process_booking_event(self, event_data):
-        """Process incoming booking event"""
+    def validate_booking_event(self, event_data):
+        """Check that a booking event can be processed, returns False for event types we don't handle
+
+        Raises ValueError for malformed events. Callers pass validated=True to
+        process_booking_event afterwards so the event is not checked again.
+        """
+        event_type = event_data.get('event_type')
+        if not event_type:
+            raise ValueError("Missing event_type in booking event")
+        if event_type not in self.event_handlers:
+            return False
+        
+        booking_data = event_data.get('booking')
+        if not isinstance(booking_data, dict):
+            raise ValueError("Booking event has no booking object")
+        
+        get = booking_data.get
+        if not get('booking_id'):
+            raise ValueError("Missing booking_id in booking event")
+        
+        if event_type == 'booking.created' and not (
+            get('guest_name') and get('guest_email') and get('hotel_name') and get('hotel_location')
+        ):
+            missing = [field for field in REQUIRED_BOOKING_FIELDS if not get(field)]
+            raise ValueError(f"Missing required booking information: {', '.join(missing)}")
+        
+        return True
+    
+    def process_booking_event(self, event_data, validated=False):
+        """Process incoming booking event, validating it first unless validated is True"""
         try:
-            event_type = event_data.get('event_type')
-            booking_data = event_data.get('booking', {})
-            
-            if event_type == 'booking.created':
-                return self._handle_booking_created(booking_data)
-            elif event_type == 'booking.updated':
-                return self._handle_booking_updated(booking_data)
-            elif event_type == 'booking.cancelled':
-                return self._handle_booking_cancelled(booking_data)
-            else:
-                logger.warning(f"Unknown event type: {event_type}")
+            if not validated and not self.validate_booking_event(event_data):
+                event_type = event_data.get('event_type')
+                logger.warning("Unknown event type: %s", event_type)
                 return {'status': 'ignored', 'message': f'Unknown event type: {event_type}'}
+            
+            return self.event_handlers[event_data['event_type']](event_data['booking'])
                 
         except Exception as e:
-            logger.error(f"Error processing booking event: {e}")
+            logger.error("Error processing booking event: %s", e)
             raise
     
     def _handle_booking_created(self, booking_data):
         """Handle new booking creation"""
         try:
             # Extract booking information
-            booking_id = booking_data.get('booking_id')
-            guest_name = booking_data.get('guest_name')
-            guest_email = booking_data.get('guest_email')
-            guest_phone = booking_data.get('guest_phone')
-            hotel_name = booking_data.get('hotel_name')
-            hotel_location = booking_data.get('hotel_location')
-            check_in_date = booking_data.get('check_in_date')
-            check_out_date = booking_data.get('check_out_date')
-            guest_language = booking_data.get('guest_language', 'en')
-            
-            # Validate required fields
-            if not all([booking_id, guest_name, guest_email, hotel_name, hotel_location]):
-                raise ValueError("Missing required booking information")
-            
-            # Check if booking already exists
-            existing_booking = Booking.query.filter_by(booking_id=booking_id).first()
-            if existing_booking:
-                logger.info(f"Booking {booking_id} already exists, updating...")
+            get = booking_data.get
+            booking_id = get('booking_id')
+            guest_name = get('guest_name')
+            guest_email = get('guest_email')
+            guest_phone = get('guest_phone')
+            hotel_name = get('hotel_name')
+            hotel_location = get('hotel_location')
+            check_in_date = get('check_in_date')
+            check_out_date = get('check_out_date')
+            guest_language = get('guest_language', 'en')
+            
+            # Create new booking record, or fall through to an update if it already exists.
+            # Inserting first means redelivered events skip geocoding an unchanged location.
+            booking = self._insert_booking({
+                'booking_id': booking_id,
+                'guest_name': guest_name,
+                'guest_email': guest_email,
+                'guest_phone': guest_phone,
+                'hotel_name': hotel_name,
+                'hotel_location': hotel_location,
+                'check_in_date': parse_date(check_in_date),
+                'check_out_date': parse_date(check_out_date),
+                'guest_language': guest_language
+            })
+            
+            if booking is None:
+                logger.info("Booking %s already exists, updating...", booking_id)
+                existing_booking = Booking.get_by_booking_id(booking_id)
                 return self._update_existing_booking(existing_booking, booking_data)
             
-            # Get coordinates for hotel location
-            coordinates = self._get_coordinates(hotel_location)
-            
-            # Create new booking record
-            booking = Booking(
-                booking_id=booking_id,
-                guest_name=guest_name,
-                guest_email=guest_email,
-                guest_phone=guest_phone,
-                hotel_name=hotel_name,
-                hotel_location=hotel_location,
-                latitude=coordinates.get('latitude'),
-                longitude=coordinates.get('longitude'),
-                check_in_date=datetime.strptime(check_in_date, '%Y-%m-%d').date() if check_in_date else None,
-                check_out_date=datetime.strptime(check_out_date, '%Y-%m-%d').date() if check_out_date else None,
-                guest_language=guest_language
-            )
+            # Get coordinates for hotel location, flushed with the chat session commit
+            coordinates = self._get_coordinates(hotel_location, booking_id)
+            booking.latitude = coordinates['latitude']
+            booking.longitude = coordinates['longitude']
             
-            db.session.add(booking)
-            db.session.commit()
-            
-            # Create chat session and send welcome message
+            # Create chat session and send welcome message, its commit also commits the booking
             chat_session = self.chatbot_service.create_chat_session(
                 booking_id, 
-                guest_language
+                guest_language,
+                booking=booking
             )
             
-            logger.info(f"Successfully processed booking creation for {booking_id}")
+            logger.info("Successfully processed booking creation for %s", booking_id)
             
             return {
                 'status': 'success',
@@ -114,64 +278,60 @@ class EventHandler:
             }
             
         except Exception as e:
-            logger.error(f"Error handling booking creation: {e}")
+            logger.error("Error handling booking creation: %s", e)
             db.session.rollback()
             raise
     
     def _handle_booking_updated(self, booking_data):
         """Handle booking update"""
         try:
-            booking_id = booking_data.get('booking_id')
-            
-            if not booking_id:
-                raise ValueError("Missing booking_id in update event")
-            
-            booking = Booking.query.filter_by(booking_id=booking_id).first()
-            if not booking:
-                logger.warning(f"Booking {booking_id} not found for update")
-                return {'status': 'not_found', 'message': f'Booking {booking_id} not found'}
+            booking_id = booking_data['booking_id']
             
-            # Update booking fields
+            # Collect changes and apply them in a single UPDATE without loading the booking
+            changes = {}
             updated_fields = []
             
-            if 'guest_name' in booking_data:
-                booking.guest_name = booking_data['guest_name']
-                updated_fields.append('guest_name')
-            
-            if 'guest_email' in booking_data:
-                booking.guest_email = booking_data['guest_email']
-                updated_fields.append('guest_email')
-            
-            if 'guest_phone' in booking_data:
-                booking.guest_phone = booking_data['guest_phone']
-                updated_fields.append('guest_phone')
-            
-            if 'hotel_location' in booking_data:
-                booking.hotel_location = booking_data['hotel_location']
-                coordinates = self._get_coordinates(booking_data['hotel_location'])
-                booking.latitude = coordinates.get('latitude')
-                booking.longitude = coordinates.get('longitude')
-                updated_fields.extend(['hotel_location', 'coordinates'])
-            
-            if 'check_in_date' in booking_data:
-                booking.check_in_date = datetime.strptime(
-                    booking_data['check_in_date'], '%Y-%m-%d'
-                ).date()
-                updated_fields.append('check_in_date')
-            
-            if 'check_out_date' in booking_data:
-                booking.check_out_date = datetime.strptime(
-                    booking_data['check_out_date'], '%Y-%m-%d'
-                ).date()
-                updated_fields.append('check_out_date')
+            for field, parse in BOOKING_UPDATE_FIELDS:
+                value = booking_data.get(field, _MISSING)
+                if value is not _MISSING:
+                    changes[field] = parse(value) if parse else value
+                    updated_fields.append(field)
+            
+            current = None
+            hotel_location = booking_data.get('hotel_location', _MISSING)
+            if hotel_location is not _MISSING:
+                current = db.session.query(Booking.hotel_location, Booking.latitude).filter_by(
+                    booking_id=booking_id
+                ).first()
+                if current is None:
+                    logger.warning("Booking %s not found for update", booking_id)
+                    return {'status': 'not_found', 'message': f'Booking {booking_id} not found'}
+                
+                # Only re-geocode when the location actually changed
+                if hotel_location != current.hotel_location or current.latitude is None:
+                    coordinates = self._get_coordinates(hotel_location, booking_id)
+                    changes['hotel_location'] = hotel_location
+                    changes['latitude'] = coordinates.get('latitude')
+                    changes['longitude'] = coordinates.get('longitude')
+                    updated_fields.extend(['hotel_location', 'coordinates'])
+            
+            if changes:
+                result = db.session.execute(
+                    update(Booking).where(Booking.booking_id == booking_id).values(**changes)
+                )
+                found = result.rowcount > 0
+            else:
+                found = current is not None or (
+                    db.session.query(Booking.id).filter_by(booking_id=booking_id).first() is not None
+                )
             
-            if 'guest_language' in booking_data:
-                booking.guest_language = booking_data['guest_language']
-                updated_fields.append('guest_language')
+            if not found:
+                logger.warning("Booking %s not found for update", booking_id)
+                return {'status': 'not_found', 'message': f'Booking {booking_id} not found'}
             
             db.session.commit()
             
-            logger.info(f"Updated booking {booking_id}, fields: {updated_fields}")
+            logger.info("Updated booking %s, fields: %s", booking_id, updated_fields)
             
             return {
                 'status': 'success',
@@ -181,33 +341,32 @@ class EventHandler:
             }
             
         except Exception as e:
-            logger.error(f"Error handling booking update: {e}")
+            logger.error("Error handling booking update: %s", e)
             db.session.rollback()
             raise
     
     def _handle_booking_cancelled(self, booking_data):
         """Handle booking cancellation"""
         try:
-            booking_id = booking_data.get('booking_id')
+            booking_id = booking_data['booking_id']
             
-            if not booking_id:
-                raise ValueError("Missing booking_id in cancellation event")
-            
-            booking = Booking.query.filter_by(booking_id=booking_id).first()
+            booking = Booking.get_by_booking_id(booking_id)
             if not booking:
-                logger.warning(f"Booking {booking_id} not found for cancellation")
+                logger.warning("Booking %s not found for cancellation", booking_id)
                 return {'status': 'not_found', 'message': f'Booking {booking_id} not found'}
             
             # Deactivate associated chat sessions
-            for chat_session in booking.chat_sessions:
-                chat_session.is_active = False
+            ChatSession.query.filter_by(booking_id=booking.id, is_active=True).update(
+                {'is_active': False},
+                synchronize_session=False
+            )
             
             # Note: We don't delete the booking record for audit purposes
             # You might want to add a 'status' field to mark it as cancelled
             
             db.session.commit()
             
-            logger.info(f"Processed cancellation for booking {booking_id}")
+            logger.info("Processed cancellation for booking %s", booking_id)
             
             return {
                 'status': 'success',
@@ -216,10 +375,30 @@ class EventHandler:
             }
             
         except Exception as e:
-            logger.error(f"Error handling booking cancellation: {e}")
+            logger.error("Error handling booking cancellation: %s", e)
             db.session.rollback()
             raise
     
+    def _insert_booking(self, values):
+        """Insert a booking in a single statement, returns None if the booking_id already exists"""
+        insert = UPSERT_INSERTS.get(db.engine.dialect.name)
+        
+        if insert is None:
+            if Booking.get_by_booking_id(values['booking_id']):
+                return None
+            booking = Booking(**values)
+            db.session.add(booking)
+            db.session.flush()
+            return booking
+        
+        stmt = (
+            insert(Booking)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=['booking_id'])
+            .returning(Booking)
+        )
+        return db.session.scalars(stmt).first()
+    
     def _update_existing_booking(self, booking, booking_data):
         """Update existing booking with new data"""
         try:
@@ -230,9 +409,11 @@ class EventHandler:
             if 'guest_email' in booking_data:
                 booking.guest_email = booking_data['guest_email']
             
-            if 'hotel_location' in booking_data:
-                booking.hotel_location = booking_data['hotel_location']
-                coordinates = self._get_coordinates(booking_data['hotel_location'])
+            # Only re-geocode when the location actually changed
+            hotel_location = booking_data.get('hotel_location')
+            if hotel_location is not None and hotel_location != booking.hotel_location:
+                booking.hotel_location = hotel_location
+                coordinates = self._get_coordinates(hotel_location, booking.booking_id)
                 booking.latitude = coordinates.get('latitude')
                 booking.longitude = coordinates.get('longitude')
             
@@ -245,40 +426,172 @@ class EventHandler:
             }
             
         except Exception as e:
-            logger.error(f"Error updating existing booking: {e}")
+            logger.error("Error updating existing booking: %s", e)
             db.session.rollback()
             raise
     
-    def _get_coordinates(self, location_string):
-        """Get latitude and longitude for a location"""
+    def _get_coordinates(self, location_string, booking_id=None):
+        """Get latitude and longitude for a location
+
+        The lookup gives up after GEOCODE_DEADLINE seconds. When the geocoder fails
+        or the deadline is reached and a booking_id is given, a geocode_booking
+        task is queued to fill in the booking's coordinates later.
+        """
+        location = normalize_location(location_string or '')
+        if len(location) < MIN_GEOCODE_LENGTH:
+            # Nothing a geocoder could resolve, skip the network round-trip
+            return {'latitude': None, 'longitude': None}
+        
+        known = HOTEL_COORDINATES.get(location)
+        if known:
+            return {'latitude': known[0], 'longitude': known[1]}
+        
         try:
-            location = self.geocoder.geocode(location_string)
-            if location:
-                return {
-                    'latitude': location.latitude,
-                    'longitude': location.longitude
-                }
-            else:
-                logger.warning(f"Could not geocode location: {location_string}")
-                return {'latitude': None, 'longitude': None}
-                
+            latitude, longitude = self._locate(location, deadline=time.monotonic() + GEOCODE_DEADLINE)
+            return {'latitude': latitude, 'longitude': longitude}
+        except LookupError:
+            logger.warning("Could not geocode location: %s", location_string)
+            return {'latitude': None, 'longitude': None}
+        except GeocodeDeadlineExceeded:
+            logger.info("Deferring geocoding fallbacks for location: %s", location_string)
+            if booking_id:
+                self._defer_geocode(booking_id, location_string)
+            return {'latitude': None, 'longitude': None}
         except Exception as e:
-            logger.error(f"Error geocoding location {location_string}: {e}")
+            logger.error("Error geocoding location %s: %s", location_string, e)
+            if booking_id:
+                self._defer_geocode(booking_id, location_string)
             return {'latitude': None, 'longitude': None}
     
+    def _defer_geocode(self, booking_id, location_string):
+        """Queue a geocode_booking task for a booking stored without coordinates"""
+        try:
+            geocode_booking.apply_async(
+                (booking_id, location_string),
+                countdown=GEOCODE_BREAKER_RESET_TIMEOUT
+            )
+        except Exception as e:
+            logger.error("Error queueing geocode for booking %s: %s", booking_id, e)
+    
+    def geocode_booking(self, booking_id, location_string):
+        """Fill in coordinates for a booking stored without them
+
+        Geocoder errors propagate so the calling task can retry. Returns True
+        if the booking was updated.
+        """
+        location = normalize_location(location_string or '')
+        if len(location) < MIN_GEOCODE_LENGTH:
+            return False
+        
+        try:
+            latitude, longitude = self._locate(location)
+        except LookupError:
+            logger.warning("Could not geocode location: %s", location_string)
+            return False
+        
+        # Skip bookings whose location changed since the lookup was queued
+        result = db.session.execute(
+            update(Booking)
+            .where(Booking.booking_id == booking_id, Booking.hotel_location == location_string)
+            .values(latitude=latitude, longitude=longitude)
+        )
+        db.session.commit()
+        
+        return result.rowcount > 0
+    
+    def _locate(self, location, deadline=None):
+        """Resolve a normalized location, falling back to coarser forms of it on a miss
+
+        With a deadline (a time.monotonic() value), raises GeocodeDeadlineExceeded
+        rather than trying a fallback whose geocoder call could run past it.
+        """
+        for attempt, candidate in enumerate(geocode_candidates(location)):
+            if attempt and deadline is not None and time.monotonic() + GEOCODE_CALL_BUDGET > deadline:
+                raise GeocodeDeadlineExceeded(location)
+            try:
+                return self._cached_coordinates(candidate)
+            except LookupError:
+                continue
+        raise LookupError(location)
+    
+    def _resolve_coordinates(self, location):
+        """Resolve a normalized location from the geocode cache table or the geocoder
+
+        Raises LookupError when the location cannot be geocoded so that misses
+        are not memoized by the in-process LRU cache. Misses, where the geocoder
+        returned nothing usable, are recorded in the table with NULL coordinates
+        and not sent to the geocoder again until NEGATIVE_GEOCODE_TTL has passed.
+        Geocoder errors and timeouts propagate before anything is recorded, so an
+        outage is retried instead of being cached as a miss.
+        """
+        location_hash = hashlib.blake2b(location.encode('utf-8'), digest_size=16).hexdigest()
+        
+        cached = db.session.get(GeocodeCache, location_hash)
+        if cached:
+            if cached.latitude is not None:
+                return cached.latitude, cached.longitude
+            if datetime.utcnow() - cached.created_at < NEGATIVE_GEOCODE_TTL:
+                raise LookupError(location)
+        
+        result = geocode_breaker.call(rate_limited_geocode, location)
+        if result and result.raw.get('addresstype', result.raw.get('type')) in COARSE_GEOCODE_TYPES:
+            # A country's centre point is no use as a hotel location, treat it as a miss
+            result = None
+        
+        if cached:
+            # Refresh the expired miss in place
+            cached.latitude = result.latitude if result else None
+            cached.longitude = result.longitude if result else None
+            cached.created_at = datetime.utcnow()
+        else:
+            self._store_geocode({
+                'location_hash': location_hash,
+                'location': location[:500],
+                'latitude': result.latitude if result else None,
+                'longitude': result.longitude if result else None,
+                'provider': 'nominatim'
+            })
+        
+        if not result:
+            raise LookupError(location)
+        
+        return result.latitude, result.longitude
+    
+    def _store_geocode(self, values):
+        """Add a geocode cache row in the caller's transaction, ignoring existing entries"""
+        insert = UPSERT_INSERTS.get(db.engine.dialect.name)
+        
+        if insert is not None:
+            db.session.execute(
+                insert(GeocodeCache).values(**values).on_conflict_do_nothing(index_elements=['location_hash'])
+            )
+            return
+        
+        try:
+            with db.session.begin_nested():
+                db.session.add(GeocodeCache(**values))
+        except IntegrityError:
+            # Another worker cached this location first
+            pass
+    
     def get_booking_summary(self, booking_id):
         """Get booking summary for debugging/monitoring"""
         try:
-            booking = Booking.query.filter_by(booking_id=booking_id).first()
+            booking = Booking.get_by_booking_id(booking_id)
             if not booking:
                 return None
             
+            chat_sessions, active_sessions = db.session.query(
+                func.count(ChatSession.id),
+                func.coalesce(func.sum(case((ChatSession.is_active == True, 1), else_=0)), 0)
+            ).filter(ChatSession.booking_id == booking.id).one()
+            
             return {
                 'booking': booking.to_dict(),
-                'chat_sessions': len(booking.chat_sessions),
-                'active_sessions': len([s for s in booking.chat_sessions if s.is_active])
+                'chat_sessions': chat_sessions,
+                'active_sessions': active_sessions
             }
             
         except Exception as e:
-            logger.error(f"Error getting booking summary: {e}")
+            logger.error("Error getting booking summary: %s", e)
             return None
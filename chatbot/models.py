@@ -1,8 +1,19 @@
 from datetime import datetime
 from config.database import db
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.dialects.postgresql import JSON
 import json
 
+# Unique index the recommendation cache upsert targets with ON CONFLICT
+RECOMMENDATION_CACHE_INDEX = 'uq_recommendations_location_language'
+
+# Dialects supporting INSERT ... ON CONFLICT for single-statement inserts and upserts
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert
+}
+
 class Booking(db.Model):
     """Model for storing booking information"""
     __tablename__ = 'bookings'
@@ -24,6 +35,11 @@ class Booking(db.Model):
     # Relationships
     chat_sessions = db.relationship('ChatSession', backref='booking', lazy=True)
 
+    @classmethod
+    def get_by_booking_id(cls, booking_id):
+        """Look up a booking by its external booking_id"""
+        return db.session.execute(BOOKING_BY_BOOKING_ID, {'booking_id': booking_id}).scalar_one_or_none()
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -39,6 +55,9 @@ class Booking(db.Model):
             'guest_language': self.guest_language
         }
 
+# Built once so lookups only bind a new booking_id and hit the compiled statement cache
+BOOKING_BY_BOOKING_ID = select(Booking).where(Booking.booking_id == bindparam('booking_id'))
+
 class ChatSession(db.Model):
     """Model for storing chat sessions"""
     __tablename__ = 'chat_sessions'
@@ -62,7 +81,8 @@ class ChatMessage(db.Model):
     session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
     message_type = db.Column(db.String(20), nullable=False)  # 'user', 'bot', 'system'
     content = db.Column(db.Text, nullable=False)
-    message_metadata = db.Column(JSON)  # Store additional data like recommendations
+    # Store additional data like recommendations, only loaded when accessed
+    message_metadata = db.deferred(db.Column(JSON))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -77,6 +97,9 @@ class ChatMessage(db.Model):
 class Recommendation(db.Model):
     """Model for caching recommendations"""
     __tablename__ = 'recommendations'
+    __table_args__ = (
+        db.Index(RECOMMENDATION_CACHE_INDEX, 'location_key', 'language', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     location_key = db.Column(db.String(200), nullable=False)  # lat_lng_category
@@ -99,3 +122,14 @@ class UserPreference(db.Model):
     language = db.Column(db.String(10), default='en')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class GeocodeCache(db.Model):
+    """Model for caching geocoded hotel locations"""
+    __tablename__ = 'geocode_cache'
+
+    location_hash = db.Column(db.String(32), primary_key=True)  # blake2b of normalized location
+    location = db.Column(db.String(500), nullable=False)
+    latitude = db.Column(db.Float)  # NULL for locations the provider could not resolve
+    longitude = db.Column(db.Float)
+    provider = db.Column(db.String(50), default='nominatim')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,14 +1,46 @@
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from geopy.distance import geodesic
+import numpy as np
+import orjson
 from config.config import Config
 from config.database import get_redis_client
-from chatbot.models import Recommendation, db
-import json
+from chatbot.models import UPSERT_INSERTS, Recommendation, db
 
 logger = logging.getLogger(__name__)
 
+EARTH_RADIUS_KM = 6371.0
+REQUEST_TIMEOUT = 10
+PLACE_DETAILS_CACHE_TIMEOUT = 86400  # 24 hours
+
+# Shared by all engines so Places API calls reuse pooled keep-alive connections
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503])
+))
+
+# Places calls are I/O bound, nearby searches and detail lookups are fanned out over this pool
+places_executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix='places')
+
+NEARBY_SEARCH_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+SIGHTSEEING_PLACE_TYPES = ('tourist_attraction', 'museum', 'park', 'zoo')
+NIGHTLIFE_PLACE_TYPES = ('bar', 'night_club', 'casino')
+
+def haversine_distances(latitude, longitude, lats, lons):
+    """Great-circle distances in kilometers from one point to arrays of points"""
+    lat1 = np.radians(latitude)
+    lon1 = np.radians(longitude)
+    lat2 = np.radians(lats)
+    lon2 = np.radians(lons)
+    
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
+
 class RecommendationEngine:
     """Engine for fetching location-based recommendations"""
     
@@ -50,20 +82,14 @@ class RecommendationEngine:
     def _get_restaurant_recommendations(self, latitude, longitude):
         """Get restaurant recommendations using Google Places API"""
         try:
-            url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-            params = {
-                'location': f"{latitude},{longitude}",
-                'radius': self.radius,
-                'type': 'restaurant',
-                'key': self.google_api_key,
-                'fields': 'name,rating,price_level,vicinity,photos,place_id'
-            }
-            
-            response = requests.get(url, params=params)
-            data = response.json()
+            places = self._nearby_search(
+                latitude, longitude, 'restaurant',
+                fields='name,rating,price_level,vicinity,photos,place_id'
+            )[:self.max_results]
+            distances = self._calculate_distances(latitude, longitude, places)
             
             restaurants = []
-            for place in data.get('results', [])[:self.max_results]:
+            for place, distance in zip(places, distances):
                 restaurant = {
                     'name': place.get('name'),
                     'rating': place.get('rating', 0),
@@ -71,20 +97,12 @@ class RecommendationEngine:
                     'address': place.get('vicinity'),
                     'place_id': place.get('place_id'),
                     'category': 'Restaurant',
-                    'distance': self._calculate_distance(
-                        latitude, longitude,
-                        place['geometry']['location']['lat'],
-                        place['geometry']['location']['lng']
-                    )
+                    'distance': distance
                 }
-                
-                # Get additional details
-                details = self._get_place_details(place.get('place_id'))
-                if details:
-                    restaurant.update(details)
-                
                 restaurants.append(restaurant)
             
+            self._add_place_details(restaurants)
+            
             return sorted(restaurants, key=lambda x: x.get('rating', 0), reverse=True)
             
         except Exception as e:
@@ -94,45 +112,28 @@ class RecommendationEngine:
     def _get_sightseeing_recommendations(self, latitude, longitude):
         """Get sightseeing recommendations"""
         try:
-            attractions = []
+            attractions = {}
             
             # Get tourist attractions
-            for place_type in ['tourist_attraction', 'museum', 'park', 'zoo']:
-                url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-                params = {
-                    'location': f"{latitude},{longitude}",
-                    'radius': self.radius,
-                    'type': place_type,
-                    'key': self.google_api_key
-                }
-                
-                response = requests.get(url, params=params)
-                data = response.json()
+            for place_type, places in self._search_place_types(latitude, longitude, SIGHTSEEING_PLACE_TYPES):
+                distances = self._calculate_distances(latitude, longitude, places)
                 
-                for place in data.get('results', []):
-                    attraction = {
+                for place, distance in zip(places, distances):
+                    # Keyed by place_id to remove duplicates across place types
+                    attractions[place.get('place_id')] = {
                         'name': place.get('name'),
                         'rating': place.get('rating', 0),
                         'address': place.get('vicinity'),
                         'place_id': place.get('place_id'),
                         'category': place_type.replace('_', ' ').title(),
-                        'distance': self._calculate_distance(
-                            latitude, longitude,
-                            place['geometry']['location']['lat'],
-                            place['geometry']['location']['lng']
-                        )
+                        'distance': distance
                     }
-                    
-                    # Get additional details
-                    details = self._get_place_details(place.get('place_id'))
-                    if details:
-                        attraction.update(details)
-                    
-                    attractions.append(attraction)
-            
-            # Remove duplicates and sort by rating
-            unique_attractions = {attr['place_id']: attr for attr in attractions}.values()
-            return sorted(list(unique_attractions), key=lambda x: x.get('rating', 0), reverse=True)[:self.max_results]
+            
+            # Sort by rating, then fetch details only for the places we return
+            top_attractions = sorted(attractions.values(), key=lambda x: x.get('rating', 0), reverse=True)[:self.max_results]
+            self._add_place_details(top_attractions)
+            
+            return top_attractions
             
         except Exception as e:
             logger.error(f"Error fetching sightseeing recommendations: {e}")
@@ -168,38 +169,23 @@ class RecommendationEngine:
     def _get_shopping_recommendations(self, latitude, longitude):
         """Get shopping recommendations"""
         try:
-            url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-            params = {
-                'location': f"{latitude},{longitude}",
-                'radius': self.radius,
-                'type': 'shopping_mall',
-                'key': self.google_api_key
-            }
-            
-            response = requests.get(url, params=params)
-            data = response.json()
+            places = self._nearby_search(latitude, longitude, 'shopping_mall')[:self.max_results]
+            distances = self._calculate_distances(latitude, longitude, places)
             
             shopping_places = []
-            for place in data.get('results', [])[:self.max_results]:
+            for place, distance in zip(places, distances):
                 shop = {
                     'name': place.get('name'),
                     'rating': place.get('rating', 0),
                     'address': place.get('vicinity'),
                     'place_id': place.get('place_id'),
                     'category': 'Shopping',
-                    'distance': self._calculate_distance(
-                        latitude, longitude,
-                        place['geometry']['location']['lat'],
-                        place['geometry']['location']['lng']
-                    )
+                    'distance': distance
                 }
-                
-                details = self._get_place_details(place.get('place_id'))
-                if details:
-                    shop.update(details)
-                
                 shopping_places.append(shop)
             
+            self._add_place_details(shopping_places)
+            
             return sorted(shopping_places, key=lambda x: x.get('rating', 0), reverse=True)
             
         except Exception as e:
@@ -209,47 +195,97 @@ class RecommendationEngine:
     def _get_nightlife_recommendations(self, latitude, longitude):
         """Get nightlife recommendations"""
         try:
-            nightlife_places = []
-            
-            for place_type in ['bar', 'night_club', 'casino']:
-                url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-                params = {
-                    'location': f"{latitude},{longitude}",
-                    'radius': self.radius,
-                    'type': place_type,
-                    'key': self.google_api_key
-                }
-                
-                response = requests.get(url, params=params)
-                data = response.json()
+            nightlife_places = {}
+            
+            for place_type, places in self._search_place_types(latitude, longitude, NIGHTLIFE_PLACE_TYPES):
+                distances = self._calculate_distances(latitude, longitude, places)
                 
-                for place in data.get('results', []):
-                    nightlife = {
+                for place, distance in zip(places, distances):
+                    nightlife_places[place.get('place_id')] = {
                         'name': place.get('name'),
                         'rating': place.get('rating', 0),
                         'address': place.get('vicinity'),
                         'place_id': place.get('place_id'),
                         'category': place_type.replace('_', ' ').title(),
-                        'distance': self._calculate_distance(
-                            latitude, longitude,
-                            place['geometry']['location']['lat'],
-                            place['geometry']['location']['lng']
-                        )
+                        'distance': distance
                     }
-                    
-                    details = self._get_place_details(place.get('place_id'))
-                    if details:
-                        nightlife.update(details)
-                    
-                    nightlife_places.append(nightlife)
             
-            unique_places = {place['place_id']: place for place in nightlife_places}.values()
-            return sorted(list(unique_places), key=lambda x: x.get('rating', 0), reverse=True)[:self.max_results]
+            top_places = sorted(nightlife_places.values(), key=lambda x: x.get('rating', 0), reverse=True)[:self.max_results]
+            self._add_place_details(top_places)
+            
+            return top_places
             
         except Exception as e:
             logger.error(f"Error fetching nightlife recommendations: {e}")
             return []
     
+    def _nearby_search(self, latitude, longitude, place_type, **extra_params):
+        """Run a Places nearby search for one place type and return its results"""
+        params = {
+            'location': f"{latitude},{longitude}",
+            'radius': self.radius,
+            'type': place_type,
+            'key': self.google_api_key,
+            **extra_params
+        }
+        
+        response = http_session.get(NEARBY_SEARCH_URL, params=params, timeout=REQUEST_TIMEOUT)
+        data = orjson.loads(response.content)
+        return data.get('results', [])
+    
+    def _search_place_types(self, latitude, longitude, place_types):
+        """Run nearby searches for several place types concurrently, returns (place_type, results) pairs"""
+        results = places_executor.map(
+            lambda place_type: self._nearby_search(latitude, longitude, place_type),
+            place_types
+        )
+        return list(zip(place_types, results))
+    
+    def _add_place_details(self, recommendations):
+        """Merge place details into recommendations in place, fetching uncached ones concurrently"""
+        place_ids = [recommendation.get('place_id') for recommendation in recommendations]
+        details_by_id = self._get_cached_place_details(place_ids)
+        
+        missing = list(dict.fromkeys(
+            place_id for place_id in place_ids if place_id and place_id not in details_by_id
+        ))
+        fetched = dict(zip(missing, places_executor.map(self._get_place_details, missing)))
+        self._cache_place_details(fetched)
+        details_by_id.update(fetched)
+        
+        for recommendation, place_id in zip(recommendations, place_ids):
+            details = details_by_id.get(place_id)
+            if details:
+                recommendation.update(details)
+    
+    def _get_cached_place_details(self, place_ids):
+        """Get cached place details for place_ids in one round-trip, keyed by place_id"""
+        place_ids = [place_id for place_id in place_ids if place_id]
+        if not place_ids:
+            return {}
+        
+        try:
+            cached = self.redis_client.mget([f"place_details:{place_id}" for place_id in place_ids])
+            return {
+                place_id: orjson.loads(data)
+                for place_id, data in zip(place_ids, cached)
+                if data
+            }
+        except Exception as e:
+            logger.error(f"Error getting cached place details: {e}")
+            return {}
+    
+    def _cache_place_details(self, details_by_id):
+        """Cache fetched place details, skipping empty results from failed lookups"""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for place_id, details in details_by_id.items():
+                if details:
+                    pipe.setex(f"place_details:{place_id}", PLACE_DETAILS_CACHE_TIMEOUT, orjson.dumps(details))
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error caching place details: {e}")
+    
     def _get_place_details(self, place_id):
         """Get additional details for a place"""
         if not place_id:
@@ -263,8 +299,8 @@ class RecommendationEngine:
                 'key': self.google_api_key
             }
             
-            response = requests.get(url, params=params)
-            data = response.json()
+            response = http_session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            data = orjson.loads(response.content)
             
             result = data.get('result', {})
             details = {}
@@ -288,13 +324,26 @@ class RecommendationEngine:
             logger.error(f"Error fetching place details: {e}")
             return {}
     
-    def _calculate_distance(self, lat1, lon1, lat2, lon2):
-        """Calculate distance between two points in kilometers"""
+    def _calculate_distances(self, latitude, longitude, places):
+        """Calculate distances in kilometers from a point to each place in a Places API result"""
+        if not places:
+            return []
+        
         try:
-            distance = geodesic((lat1, lon1), (lat2, lon2)).kilometers
-            return round(distance, 2)
-        except:
-            return 0
+            lats = np.fromiter(
+                (place['geometry']['location']['lat'] for place in places),
+                dtype=np.float64,
+                count=len(places)
+            )
+            lons = np.fromiter(
+                (place['geometry']['location']['lng'] for place in places),
+                dtype=np.float64,
+                count=len(places)
+            )
+            distances = haversine_distances(latitude, longitude, lats, lons)
+            return np.round(distances, 2).tolist()
+        except Exception:
+            return [0] * len(places)
     
     def _get_cached_recommendations(self, location_key, language):
         """Get recommendations from cache"""
@@ -304,7 +353,7 @@ class RecommendationEngine:
             cached_data = self.redis_client.get(cache_key)
             
             if cached_data:
-                return json.loads(cached_data)
+                return orjson.loads(cached_data)
             
             # Check database cache
             recommendation = Recommendation.query.filter_by(
@@ -317,7 +366,7 @@ class RecommendationEngine:
                 self.redis_client.setex(
                     cache_key, 
                     Config.CACHE_TIMEOUT, 
-                    json.dumps(recommendation.data)
+                    orjson.dumps(recommendation.data)
                 )
                 return recommendation.data
             
@@ -335,32 +384,43 @@ class RecommendationEngine:
             self.redis_client.setex(
                 cache_key, 
                 Config.CACHE_TIMEOUT, 
-                json.dumps(recommendations)
+                orjson.dumps(recommendations)
             )
             
             # Cache in database
-            expires_at = datetime.utcnow() + timedelta(seconds=Config.CACHE_TIMEOUT)
-            
-            # Remove old cache entry if exists
-            old_recommendation = Recommendation.query.filter_by(
-                location_key=location_key,
-                language=language
-            ).first()
-            
-            if old_recommendation:
-                db.session.delete(old_recommendation)
+            now = datetime.utcnow()
+            values = {
+                'location_key': location_key,
+                'category': location_key.split('_')[2],  # Extract category from key
+                'data': recommendations,
+                'language': language,
+                'created_at': now,
+                'expires_at': now + timedelta(seconds=Config.CACHE_TIMEOUT)
+            }
             
-            # Create new cache entry
-            recommendation = Recommendation(
-                location_key=location_key,
-                category=location_key.split('_')[2],  # Extract category from key
-                data=recommendations,
-                language=language,
-                expires_at=expires_at
-            )
+            insert = UPSERT_INSERTS.get(db.engine.dialect.name)
+            if insert is not None:
+                # Replace any existing entry in a single statement
+                stmt = insert(Recommendation).values(**values)
+                db.session.execute(stmt.on_conflict_do_update(
+                    index_elements=['location_key', 'language'],
+                    set_={
+                        'category': stmt.excluded.category,
+                        'data': stmt.excluded.data,
+                        'created_at': stmt.excluded.created_at,
+                        'expires_at': stmt.excluded.expires_at
+                    }
+                ))
+            else:
+                # Remove old cache entry if exists
+                Recommendation.query.filter_by(
+                    location_key=location_key,
+                    language=language
+                ).delete(synchronize_session=False)
+                db.session.add(Recommendation(**values))
             
-            db.session.add(recommendation)
             db.session.commit()
             
         except Exception as e:
             logger.error(f"Error caching recommendations: {e}")
+            db.session.rollback()
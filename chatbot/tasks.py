@@ -0,0 +1,80 @@
+import logging
+from celery import Celery
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+celery = Celery(
+    'treebo-chatbot',
+    broker=Config.CELERY_BROKER_URL,
+    backend=Config.CELERY_RESULT_BACKEND
+)
+
+celery.conf.beat_schedule = {
+    'flush-chat-messages': {
+        'task': 'chatbot.tasks.flush_chat_messages',
+        'schedule': Config.MESSAGE_FLUSH_INTERVAL
+    }
+}
+
+_flask_app = None
+_chatbot_service = None
+_event_handler = None
+
+def _get_flask_app():
+    """Create the Flask app used by worker tasks on first use"""
+    global _flask_app
+    if _flask_app is None:
+        from app import create_app
+        _flask_app = create_app()
+    return _flask_app
+
+def _get_chatbot_service():
+    """Create the chatbot service used by worker tasks on first use"""
+    global _chatbot_service
+    if _chatbot_service is None:
+        from chatbot.chatbot_service import ChatbotService
+        _chatbot_service = ChatbotService()
+    return _chatbot_service
+
+def _get_event_handler():
+    """Create the event handler used by worker tasks on first use"""
+    global _event_handler
+    if _event_handler is None:
+        from chatbot.event_handler import EventHandler
+        _event_handler = EventHandler()
+    return _event_handler
+
+@celery.task(name='chatbot.tasks.flush_chat_messages')
+def flush_chat_messages():
+    """Persist chat messages buffered in Redis to the database"""
+    with _get_flask_app().app_context():
+        flushed = _get_chatbot_service().flush_buffered_messages()
+
+    if flushed:
+        logger.info(f"Flushed {flushed} buffered chat messages")
+
+    return flushed
+
+@celery.task(bind=True, name='chatbot.tasks.process_booking_event', max_retries=5)
+def process_booking_event(self, event_data):
+    """Process a booking event acknowledged by the webhook"""
+    try:
+        with _get_flask_app().app_context():
+            # The webhook validated the event before queueing it
+            return _get_event_handler().process_booking_event(event_data, validated=True)
+    except ValueError as e:
+        # Invalid payloads will not succeed on retry
+        logger.error(f"Dropping invalid booking event: {e}")
+        return {'status': 'error', 'message': str(e)}
+    except Exception as e:
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+
+@celery.task(bind=True, name='chatbot.tasks.geocode_booking', max_retries=5, ignore_result=True)
+def geocode_booking(self, booking_id, location):
+    """Geocode a booking that was stored without coordinates"""
+    try:
+        with _get_flask_app().app_context():
+            return _get_event_handler().geocode_booking(booking_id, location)
+    except Exception as e:
+        raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
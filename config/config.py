@@ -1,13 +1,36 @@
 import os
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def json_serializer(obj):
+    """Serialize JSON columns with orjson"""
+    return orjson.dumps(obj).decode('utf-8')
+
 class Config:
     """Base configuration class"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'treebo-chatbot-secret-key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///treebo_chatbot.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'json_serializer': json_serializer,
+        'json_deserializer': orjson.loads
+    }
+    
+    # Connection pool options for server databases (not applied to SQLite). Pool sizes keep
+    # SQLAlchemy's defaults unless DB_POOL_SIZE / DB_MAX_OVERFLOW are set, the timeout,
+    # recycle and pre-ping settings are what differ from a default engine.
+    # Each process (web or Celery worker) has its own pool, so the database can see up to
+    # processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections, e.g. 6 * (5 + 10) = 90.
+    # Keep that under Postgres max_connections (100 by default) when adding workers.
+    SQLALCHEMY_POOL_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    }
     
     # Redis configuration for caching
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
@@ -26,9 +49,20 @@ class Config:
     MAX_RECOMMENDATIONS_PER_CATEGORY = 5
     CACHE_TIMEOUT = 3600  # 1 hour
     
+    # Chat message buffering (Redis write-through, flushed to SQL by Celery)
+    MESSAGE_BUFFER_TTL = 86400  # 24 hours
+    MESSAGE_FLUSH_INTERVAL = 5  # seconds
+    MESSAGE_FLUSH_BATCH_SIZE = 500
+    
+    # JSON file mapping known hotel locations to [latitude, longitude], checked before geocoding
+    HOTEL_COORDINATES_FILE = os.environ.get('HOTEL_COORDINATES_FILE')
+    
     # Webhook security
     WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or 'treebo-webhook-secret'
     
+    # Acknowledge booking webhooks immediately and process them on the Celery worker
+    PROCESS_BOOKING_EVENTS_ASYNC = os.environ.get('PROCESS_BOOKING_EVENTS_ASYNC', 'false').lower() == 'true'
+    
     # Celery configuration
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or 'redis://localhost:6379/1'
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND') or 'redis://localhost:6379/1'
@@ -48,6 +82,7 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test_treebo_chatbot.db'
+    PROCESS_BOOKING_EVENTS_ASYNC = False
 
 config = {
     'development': DevelopmentConfig,
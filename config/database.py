@@ -4,7 +4,8 @@ import redis
 from config.config import Config
 
 # Initialize database
-db = SQLAlchemy()
+# Objects stay loaded after commit so responses built from them don't re-SELECT
+db = SQLAlchemy(session_options={'expire_on_commit': False})
 migrate = Migrate()
 
 # Initialize Redis for caching
@@ -12,6 +13,13 @@ redis_client = redis.from_url(Config.REDIS_URL, decode_responses=True)
 
 def init_db(app):
     """Initialize database with Flask app"""
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        # SQLite engines use their own pool classes that don't take QueuePool sizing
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+            **app.config.get('SQLALCHEMY_POOL_OPTIONS', {})
+        }
+    
     db.init_app(app)
     migrate.init_app(app, db)
     
@@ -0,0 +1,46 @@
+"""add recommendation cache unique index
+
+db.create_all() does not alter existing tables, so recommendations tables
+created before the index have nothing for the cache upsert's ON CONFLICT
+clause to match. Duplicate cache rows are removed first, keeping the newest
+entry for each location and language.
+
+Revision ID: 75ab43a56b61
+Revises: 
+Create Date: 2026-10-15 23:14:56.987307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '75ab43a56b61'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'uq_recommendations_location_language'
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('recommendations'):
+        # db.create_all() will create the table with the index
+        return
+    if INDEX_NAME in {index['name'] for index in inspector.get_indexes('recommendations')}:
+        return
+
+    op.execute(
+        """
+        DELETE FROM recommendations
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM recommendations GROUP BY location_key, language
+        )
+        """
+    )
+    op.create_index(INDEX_NAME, 'recommendations', ['location_key', 'language'], unique=True)
+
+
+def downgrade():
+    op.drop_index(INDEX_NAME, table_name='recommendations')
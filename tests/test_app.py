@@ -1,8 +1,28 @@
 import pytest
 import json
+import os
+import hashlib
+import hmac
+import fakeredis
+import orjson
+from datetime import date, datetime, timedelta
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+from geopy.location import Location
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError
+from flask_migrate import downgrade, upgrade
 from app import create_app
 from config.database import db
-from chatbot.models import Booking, ChatSession
+from chatbot.models import (
+    Booking, ChatSession, ChatMessage, GeocodeCache, Recommendation, RECOMMENDATION_CACHE_INDEX
+)
+from chatbot.chatbot_service import ChatbotService, PENDING_MESSAGES_KEY, DEAD_MESSAGES_KEY
+from chatbot import chatbot_service as chatbot_service_module, event_handler
+from chatbot.event_handler import (
+    CircuitBreaker, CircuitOpenError, EventHandler, geocode_candidates, normalize_location
+)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'migrations')
 
 @pytest.fixture
 def app():
@@ -12,6 +32,8 @@ def app():
     with app.app_context():
         db.create_all()
         yield app
+        # Roll back anything a test left uncommitted, it would lock SQLite against drop_all
+        db.session.remove()
         db.drop_all()
 
 @pytest.fixture
@@ -37,6 +59,51 @@ def sample_booking_event():
         }
     }
 
+@pytest.fixture
+def booking(app):
+    """Booking stored in the test database"""
+    booking = Booking(
+        booking_id='TEST123',
+        guest_name='Test User',
+        guest_email='test@example.com',
+        hotel_name='Test Hotel',
+        hotel_location='Test Location, Test City',
+        check_in_date=date(2024, 1, 15),
+        check_out_date=date(2024, 1, 17)
+    )
+    db.session.add(booking)
+    db.session.commit()
+    return booking
+
+@pytest.fixture
+def buffered_app(monkeypatch):
+    """Test application whose chat services buffer messages in an in-memory Redis"""
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(chatbot_service_module, 'get_redis_client', lambda: redis_client)
+    app = create_app('testing')
+    
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def chatbot_service(app):
+    """Chatbot service backed by an in-memory Redis"""
+    service = ChatbotService()
+    service.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    return service
+
+def test_json_responses_match_flask_format(app):
+    """Test that orjson responses keep Flask's sorted keys and HTTP dates"""
+    data = {'b': 1, 'a': datetime(2024, 1, 15, 10, 30), 'c': date(2024, 1, 15), 1: 'one'}
+    
+    assert app.json.dumps(data) == (
+        '{"1":"one","a":"Mon, 15 Jan 2024 10:30:00 GMT","b":1,"c":"Mon, 15 Jan 2024 00:00:00 GMT"}'
+    )
+    assert app.json.response(data).get_json() == json.loads(app.json.dumps(data))
+
 def test_health_check(client):
     """Test health check endpoint"""
     response = client.get('/health')
@@ -161,8 +228,427 @@ def test_invalid_booking_webhook(client):
     
     assert response.status_code == 400
 
+def test_booking_webhook_queued(app, client, sample_booking_event, monkeypatch):
+    """Test that valid booking events are queued when async processing is enabled"""
+    from chatbot import tasks
+    
+    queued = []
+    monkeypatch.setattr(tasks.process_booking_event, 'delay',
+                        lambda event: queued.append(event) or type('Result', (), {'id': 'task-1'})())
+    app.config['PROCESS_BOOKING_EVENTS_ASYNC'] = True
+    
+    response = client.post('/webhook/booking', json=sample_booking_event)
+    
+    assert response.status_code == 202
+    assert response.get_json() == {'status': 'queued', 'booking_id': 'TEST123', 'task_id': 'task-1'}
+    assert queued == [sample_booking_event]
+
+@pytest.mark.parametrize('async_events', [True, False])
+def test_incomplete_booking_webhook_rejected(app, client, sample_booking_event, monkeypatch, async_events):
+    """Test that incomplete or malformed booking events are rejected before they are queued"""
+    from chatbot import tasks
+    
+    queued = []
+    monkeypatch.setattr(tasks.process_booking_event, 'delay', queued.append)
+    app.config['PROCESS_BOOKING_EVENTS_ASYNC'] = async_events
+    del sample_booking_event['booking']['hotel_location']
+    
+    response = client.post('/webhook/booking', json=sample_booking_event)
+    
+    assert response.status_code == 400
+    assert 'hotel_location' in response.get_json()['error']
+    
+    response = client.post('/webhook/booking', json={'event_type': 'booking.created', 'booking': 'TEST123'})
+    
+    assert response.status_code == 400
+    assert queued == []
+
+def test_booking_webhook_validates_once(client, sample_booking_event, geocoder, monkeypatch):
+    """Test that booking events are validated at the webhook and not again while processing"""
+    calls = []
+    validate = EventHandler.validate_booking_event
+    monkeypatch.setattr(EventHandler, 'validate_booking_event',
+                        lambda self, event: calls.append(event) or validate(self, event))
+    
+    response = client.post('/webhook/booking', json=sample_booking_event)
+    
+    assert response.status_code == 200
+    assert len(calls) == 1
+
+def test_unknown_booking_event_ignored(client):
+    """Test that event types without a handler are acknowledged and ignored"""
+    response = client.post('/webhook/booking', json={'event_type': 'booking.noshow', 'booking': {}})
+    
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'ignored'
+
 def test_nonexistent_booking(client):
     """Test accessing nonexistent booking"""
     response = client.get('/booking/NONEXISTENT')
     
     assert response.status_code == 404
+
+def test_calculate_distances():
+    """Test vectorized distance calculation for Places API results"""
+    from chatbot.recommendation_engine import RecommendationEngine
+    
+    places = [
+        {'geometry': {'location': {'lat': 28.6139, 'lng': 77.2090}}},
+        {'geometry': {'location': {'lat': 19.0760, 'lng': 72.8777}}}
+    ]
+    
+    distances = RecommendationEngine()._calculate_distances(28.6139, 77.2090, places)
+    
+    assert distances[0] == 0
+    assert abs(distances[1] - 1148.09) < 0.01
+    assert RecommendationEngine()._calculate_distances(None, None, places) == [0, 0]
+
+def test_recommendation_cache_index_added_to_existing_table(app):
+    """Test that the migration adds the upsert index to older recommendations tables after removing duplicates"""
+    from chatbot.recommendation_engine import RecommendationEngine
+    
+    index = next(i for i in Recommendation.__table__.indexes if i.name == RECOMMENDATION_CACHE_INDEX)
+    index.drop(db.engine)
+    for data in ([{'name': 'Old'}], [{'name': 'New'}]):
+        db.session.add(Recommendation(
+            location_key='1.0_2.0_restaurants_en', category='restaurants',
+            data=data, language='en', expires_at=datetime.utcnow()
+        ))
+    db.session.commit()
+    
+    upgrade(directory=MIGRATIONS_DIR)
+    
+    assert RECOMMENDATION_CACHE_INDEX in {i['name'] for i in inspect(db.engine).get_indexes('recommendations')}
+    assert [r.data for r in Recommendation.query.all()] == [[{'name': 'New'}]]
+    
+    engine = RecommendationEngine()
+    engine.redis_client = fakeredis.FakeRedis()
+    engine._cache_recommendations('1.0_2.0_restaurants_en', [{'name': 'Fresh'}], 'en')
+    
+    db.session.expire_all()
+    assert [r.data for r in Recommendation.query.all()] == [[{'name': 'Fresh'}]]
+    
+    downgrade(directory=MIGRATIONS_DIR, revision='base')
+
+def test_buffered_messages_are_flushed(chatbot_service, booking, monkeypatch):
+    """Test that messages are buffered in Redis and flushed to the database"""
+    seeded = []
+    monkeypatch.setattr(chatbot_service, '_get_persisted_messages', lambda session_id: seeded.append(session_id) or [])
+    
+    result = chatbot_service.create_chat_session('TEST123', 'en', booking=booking)
+    
+    # A new session has no history to load
+    assert seeded == []
+    # Only PostgreSQL reserves ids up front, SQLite assigns them when the messages are flushed
+    assert [message['id'] for message in result['messages']] == [None, None]
+    assert ChatMessage.query.count() == 0
+    
+    assert chatbot_service.flush_buffered_messages() == 2
+    assert [m.content for m in ChatMessage.query.order_by(ChatMessage.id)] == [
+        message['content'] for message in result['messages']
+    ]
+    assert chatbot_service.redis_client.llen(PENDING_MESSAGES_KEY) == 0
+    assert chatbot_service.flush_buffered_messages() == 0
+
+def test_transcript_seed_failure_does_not_duplicate_messages(chatbot_service, booking, monkeypatch):
+    """Test that a failed transcript seed doesn't also write the messages to the database"""
+    result = chatbot_service.create_chat_session('TEST123', 'en', booking=booking)
+    chatbot_service.flush_buffered_messages()
+    chat_session = ChatSession.query.filter_by(session_id=result['session_id']).one()
+    
+    # Transcript expired, and loading the history for it fails
+    chatbot_service.redis_client.delete(f"chat:{chat_session.id}")
+    def fail(session_id):
+        raise RuntimeError('database unavailable')
+    monkeypatch.setattr(chatbot_service, '_get_persisted_messages', fail)
+    
+    message = chatbot_service._add_message(chat_session.id, 'user', 'hello')
+    
+    assert message['content'] == 'hello'
+    assert ChatMessage.query.count() == 2
+    assert chatbot_service.flush_buffered_messages() == 1
+    assert ChatMessage.query.count() == 3
+    assert chatbot_service.redis_client.exists(f"chat:{chat_session.id}") == 0
+
+def test_message_counts_include_buffered_messages(buffered_app):
+    """Test that session and admin message counts include messages not flushed yet"""
+    client = buffered_app.test_client()
+    booking = Booking(
+        booking_id='TEST123', guest_name='Test User', guest_email='test@example.com',
+        hotel_name='Test Hotel', hotel_location='Test Location, Test City',
+        check_in_date=date(2024, 1, 15), check_out_date=date(2024, 1, 17)
+    )
+    chat_session = ChatSession(session_id='SESSION1', booking=booking)
+    db.session.add_all([booking, chat_session])
+    db.session.commit()
+    service = ChatbotService()
+    service._add_messages(chat_session.id, [('user', 'Hi', None), ('bot', 'Hello', None)], new_session=True)
+    
+    sessions = client.get('/booking/TEST123/sessions').get_json()['sessions']
+    stats = client.get('/admin/stats').get_json()
+    
+    assert ChatMessage.query.count() == 0
+    assert sessions[0]['message_count'] == 2
+    assert stats['total_messages'] == 2
+    
+    service.flush_buffered_messages()
+    
+    assert client.get('/admin/stats').get_json()['total_messages'] == 2
+
+def test_flush_moves_unwritable_messages_to_dead_letter(chatbot_service, booking):
+    """Test that a message that can't be written doesn't block the rest of the queue"""
+    chatbot_service.create_chat_session('TEST123', 'en', booking=booking)
+    bad_message = orjson.dumps({
+        'session_id': 999,
+        'id': None,
+        'message_type': 'bot',
+        'content': None,
+        'metadata': None,
+        'timestamp': '2024-01-15T10:00:00'
+    })
+    chatbot_service.redis_client.lpush(PENDING_MESSAGES_KEY, bad_message)
+    
+    assert chatbot_service.flush_buffered_messages() == 2
+    assert ChatMessage.query.count() == 2
+    assert chatbot_service.redis_client.lrange(DEAD_MESSAGES_KEY, 0, -1) == [bad_message.decode()]
+    assert chatbot_service.redis_client.llen(PENDING_MESSAGES_KEY) == 0
+    assert chatbot_service.flush_buffered_messages() == 0
+
+def test_flush_requeues_batch_when_database_fails(chatbot_service, booking, monkeypatch):
+    """Test that a database outage puts the batch back at the head of the queue"""
+    chatbot_service.create_chat_session('TEST123', 'en', booking=booking)
+    pending = chatbot_service.redis_client.lrange(PENDING_MESSAGES_KEY, 0, -1)
+    
+    def fail():
+        raise OperationalError('INSERT', {}, Exception('connection refused'))
+    
+    with monkeypatch.context() as m:
+        m.setattr(db.session, 'commit', fail)
+        with pytest.raises(OperationalError):
+            chatbot_service.flush_buffered_messages()
+    
+    assert chatbot_service.redis_client.lrange(PENDING_MESSAGES_KEY, 0, -1) == pending
+    assert chatbot_service.redis_client.llen(DEAD_MESSAGES_KEY) == 0
+    assert chatbot_service.flush_buffered_messages() == 2
+
+def test_geocode_candidates():
+    """Test that geocoding falls back to coarser locations but never to the country alone"""
+    assert list(geocode_candidates(normalize_location('Treebo Trend Sapphire,  Goa, India'))) == [
+        'treebo trend sapphire, goa, india',
+        'goa, india'
+    ]
+    assert list(geocode_candidates('hotel x, 5th block, india')) == [
+        'hotel x, 5th block, india',
+        '5th block, india'
+    ]
+    assert list(geocode_candidates('treebo akshaya, koramangala, bengaluru, karnataka, india')) == [
+        'treebo akshaya, koramangala, bengaluru, karnataka, india',
+        'koramangala, bengaluru, karnataka, india',
+        'bengaluru, karnataka, india'
+    ]
+    assert list(geocode_candidates('goa, india')) == ['goa, india']
+    assert list(geocode_candidates('mumbai')) == ['mumbai']
+
+def test_country_level_geocode_is_rejected(app, monkeypatch):
+    """Test that a country-level geocode result is not used as the hotel's coordinates"""
+    queries = []
+    def geocode(query):
+        queries.append(query)
+        return Location('India', (20.59, 78.96), {'addresstype': 'country'})
+    monkeypatch.setattr(event_handler, 'rate_limited_geocode', geocode)
+    
+    coordinates = EventHandler()._get_coordinates('Hotel X, India')
+    
+    assert coordinates == {'latitude': None, 'longitude': None}
+    assert queries == ['hotel x, india']
+
+class FakeGeocoder:
+    """Stands in for the rate limited Nominatim geocode call"""
+    
+    def __init__(self):
+        self.results = {}
+        self.queries = []
+    
+    def __call__(self, query):
+        self.queries.append(query)
+        result = self.results.get(query)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+@pytest.fixture
+def geocoder(monkeypatch):
+    """Fake geocoder behind a fresh circuit breaker"""
+    fake = FakeGeocoder()
+    monkeypatch.setattr(event_handler, 'rate_limited_geocode', fake)
+    monkeypatch.setattr(event_handler, 'geocode_breaker', CircuitBreaker(5, 60))
+    return fake
+
+def test_duplicate_booking_created_updates_booking(client, sample_booking_event, geocoder):
+    """Test that a repeated booking.created event updates the existing booking"""
+    geocoder.results['test location, test city'] = Location('Test City', (12.97, 77.59), {})
+    
+    first = client.post('/webhook/booking', json=sample_booking_event)
+    sample_booking_event['booking']['guest_name'] = 'Renamed User'
+    second = client.post('/webhook/booking', json=sample_booking_event)
+    
+    assert first.get_json()['status'] == 'success'
+    assert second.get_json()['status'] == 'updated'
+    assert Booking.query.count() == 1
+    assert Booking.get_by_booking_id('TEST123').guest_name == 'Renamed User'
+
+def test_duplicate_booking_created_skips_geocoding(client, sample_booking_event, geocoder, monkeypatch):
+    """Test that a redelivered booking.created with an unchanged location is not geocoded again"""
+    geocoder.results['test location, test city'] = Location('Test City', (12.97, 77.59), {})
+    lookups = []
+    get_coordinates = EventHandler._get_coordinates
+    monkeypatch.setattr(EventHandler, '_get_coordinates',
+                        lambda self, *args: lookups.append(args[0]) or get_coordinates(self, *args))
+    
+    client.post('/webhook/booking', json=sample_booking_event)
+    client.post('/webhook/booking', json=sample_booking_event)
+    
+    assert lookups == ['Test Location, Test City']
+    assert Booking.get_by_booking_id('TEST123').latitude == 12.97
+    
+    sample_booking_event['booking']['hotel_location'] = 'Other Location, Test City'
+    client.post('/webhook/booking', json=sample_booking_event)
+    
+    assert lookups == ['Test Location, Test City', 'Other Location, Test City']
+
+def test_circuit_breaker_transitions(monkeypatch):
+    """Test that the breaker opens after fail_max failures and lets a trial call through after reset_timeout"""
+    now = [0]
+    monkeypatch.setattr(event_handler.time, 'monotonic', lambda: now[0])
+    breaker = CircuitBreaker(fail_max=2, reset_timeout=60)
+    def fail():
+        raise ConnectionError('geocoder down')
+    
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+    
+    # Open, calls are rejected without reaching the dependency
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+    
+    # Half-open, a failing trial call opens the breaker again
+    now[0] = 61
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+    
+    # Half-open, a successful trial call closes the breaker and resets the failure count
+    now[0] = 122
+    assert breaker.call(lambda: 'ok') == 'ok'
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.call(lambda: 'ok') == 'ok'
+
+def test_failed_geocode_is_deferred(booking, geocoder, monkeypatch):
+    """Test that a geocoder failure queues geocode_booking, which fills in the coordinates later"""
+    queued = []
+    monkeypatch.setattr(event_handler.geocode_booking, 'apply_async',
+                        lambda args, countdown: queued.append(args))
+    geocoder.results['test location, test city'] = ConnectionError('geocoder down')
+    handler = EventHandler()
+    
+    coordinates = handler._get_coordinates(booking.hotel_location, booking.booking_id)
+    
+    assert coordinates == {'latitude': None, 'longitude': None}
+    assert queued == [('TEST123', 'Test Location, Test City')]
+    
+    geocoder.results['test location, test city'] = Location('Test City', (12.97, 77.59), {})
+    
+    assert handler.geocode_booking(*queued[0]) is True
+    db.session.refresh(booking)
+    assert (booking.latitude, booking.longitude) == (12.97, 77.59)
+    assert handler.geocode_booking('TEST123', 'Moved Location, Test City') is False
+
+def test_geocoder_timeout_is_deferred(booking, monkeypatch):
+    """Test that geocoder errors pass through the real RateLimiter to the breaker and defer the lookup"""
+    def timed_out(query):
+        raise GeocoderTimedOut('Service timed out')
+    monkeypatch.setattr(event_handler.rate_limited_geocode, 'func', timed_out)
+    breaker = CircuitBreaker(5, 60)
+    monkeypatch.setattr(event_handler, 'geocode_breaker', breaker)
+    deferred = []
+    monkeypatch.setattr(EventHandler, '_defer_geocode', lambda self, *args: deferred.append(args))
+    
+    coordinates = EventHandler()._get_coordinates(booking.hotel_location, booking.booking_id)
+    
+    assert coordinates == {'latitude': None, 'longitude': None}
+    assert deferred == [('TEST123', 'Test Location, Test City')]
+    assert breaker._failures == 1
+    assert GeocodeCache.query.count() == 0
+
+def test_slow_geocode_fallbacks_are_deferred(app, geocoder, monkeypatch):
+    """Test that inline geocoding leaves fallbacks that could overrun its deadline to geocode_booking"""
+    clock = [100.0]
+    monkeypatch.setattr(event_handler.time, 'monotonic', lambda: clock[0])
+    def slow_geocode(query):
+        clock[0] += event_handler.GEOCODE_TIMEOUT
+        return geocoder(query)
+    monkeypatch.setattr(event_handler, 'rate_limited_geocode', slow_geocode)
+    deferred = []
+    monkeypatch.setattr(EventHandler, '_defer_geocode', lambda self, *args: deferred.append(args))
+    location = 'Treebo Akshaya, Koramangala, Bengaluru, Karnataka, India'
+    geocoder.results['koramangala, bengaluru, karnataka, india'] = Location('Koramangala', (12.93, 77.62), {})
+    handler = EventHandler()
+    
+    coordinates = handler._get_coordinates(location, 'TEST123')
+    
+    assert coordinates == {'latitude': None, 'longitude': None}
+    assert geocoder.queries == ['treebo akshaya, koramangala, bengaluru, karnataka, india']
+    assert deferred == [('TEST123', location)]
+    
+    # The deferred task has no deadline and goes on to the fallbacks
+    assert handler._locate(normalize_location(location)) == (12.93, 77.62)
+
+def test_negative_geocode_results_expire(app, geocoder):
+    """Test that a geocoding miss is not retried until NEGATIVE_GEOCODE_TTL has passed"""
+    handler = EventHandler()
+    
+    for _ in range(2):
+        with pytest.raises(LookupError):
+            handler._resolve_coordinates('nowhere town')
+    
+    assert geocoder.queries == ['nowhere town']
+    cached = GeocodeCache.query.filter_by(location='nowhere town').one()
+    assert (cached.latitude, cached.longitude) == (None, None)
+    
+    cached.created_at -= event_handler.NEGATIVE_GEOCODE_TTL + timedelta(minutes=1)
+    geocoder.results['nowhere town'] = Location('Nowhere Town', (10.0, 20.0), {})
+    
+    assert handler._resolve_coordinates('nowhere town') == (10.0, 20.0)
+    assert geocoder.queries == ['nowhere town', 'nowhere town']
+    assert (cached.latitude, cached.longitude) == (10.0, 20.0)
+
+def test_geocoder_errors_are_not_cached(app, geocoder):
+    """Test that geocoder errors are neither stored as misses nor memoized"""
+    geocoder.results['goa, india'] = GeocoderUnavailable('Service unavailable')
+    handler = EventHandler()
+    
+    for _ in range(2):
+        with pytest.raises(GeocoderUnavailable):
+            handler._cached_coordinates('goa, india')
+    
+    assert GeocodeCache.query.count() == 0
+    
+    geocoder.results['goa, india'] = Location('Goa', (15.3, 74.1), {})
+    
+    assert handler._cached_coordinates('goa, india') == (15.3, 74.1)
+    assert geocoder.queries == ['goa, india'] * 3
+
+def test_verify_webhook_signature():
+    """Test HMAC-SHA256 webhook signature checks"""
+    handler = EventHandler('secret')
+    payload = b'{"event_type": "booking.created"}'
+    digest = hmac.new(b'secret', payload, hashlib.sha256).hexdigest()
+    
+    assert handler.verify_webhook_signature(payload, f'sha256={digest}')
+    assert not handler.verify_webhook_signature(payload + b' ', f'sha256={digest}')
+    assert not handler.verify_webhook_signature(payload, digest)
+    assert not handler.verify_webhook_signature(payload, 'sha256=not-hex')
+    assert not handler.verify_webhook_signature(payload, f'sha256={digest}', secret='other')